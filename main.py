@@ -1,28 +1,114 @@
 import os
+import time
+import asyncio
+import math
+from datetime import datetime, timezone
+from fractions import Fraction
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
+from pymongo import WriteConcern
 from typing import Optional, List
 
-from database import db, create_document, get_documents
-from schemas import GSTCategory, GSTCalculation
+from database import db, create_document, create_documents, get_documents
+from schemas import GSTCalculation
 
-app = FastAPI(title="GST Calculator API", version="1.0.0")
+# Environment doesn't change at runtime; read it once (database has already loaded .env)
+_HAS_DB_URL = bool(os.getenv("DATABASE_URL"))
+_HAS_DB_NAME = bool(os.getenv("DATABASE_NAME"))
+
+try:
+    import ahocorasick
+except ImportError:  # fall back to first-byte keyword buckets
+    ahocorasick = None
+
+app = FastAPI(title="GST Calculator API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Comma-separated list of frontend origins; falls back to allowing any origin when unset
+_ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "").split(",") if o.strip()] or ["*"]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=_ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,
 )
 
+# Calculation audit logs are queued and written in batches off the request path
+_LOG_BATCH_SIZE = 1000
+_LOG_FLUSH_INTERVAL = 1.0
+_LOG_QUEUE_MAX = 10 * _LOG_BATCH_SIZE  # logs beyond this are dropped rather than buffered
+_log_queue: Optional[asyncio.Queue] = None
+_log_task: Optional[asyncio.Task] = None
+
+async def _flush_logs(batch: List[dict]) -> None:
+    try:
+        await create_documents("gstcalculation", batch, ordered=False, write_concern=WriteConcern(w=0))
+    except Exception:
+        pass
+
+async def _log_writer() -> None:
+    loop = asyncio.get_running_loop()
+    batch: List[dict] = []
+    flush: Optional[asyncio.Future] = None
+    try:
+        while True:
+            batch.append(await _log_queue.get())
+            deadline = loop.time() + _LOG_FLUSH_INTERVAL
+            while len(batch) < _LOG_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_log_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Shielded so a shutdown cancel doesn't abandon the batch mid-write
+            flush = asyncio.ensure_future(_flush_logs(batch))
+            batch = []
+            await asyncio.shield(flush)
+    finally:
+        # On shutdown, finish the in-flight write, then write whatever is still queued
+        if flush is not None and not flush.done():
+            await flush
+        while not _log_queue.empty():
+            batch.append(_log_queue.get_nowait())
+        if batch:
+            await _flush_logs(batch)
+
+@app.on_event("startup")
+async def warm_database():
+    # Open the connection pool before the first request needs it
+    if db is not None:
+        try:
+            await db.command("ping")
+        except Exception:
+            pass
+
+@app.on_event("startup")
+async def start_log_writer():
+    global _log_queue, _log_task
+    _log_queue = asyncio.Queue(maxsize=_LOG_QUEUE_MAX)
+    _log_task = asyncio.create_task(_log_writer())
+
+@app.on_event("shutdown")
+async def stop_log_writer():
+    if _log_task is not None:
+        _log_task.cancel()
+        try:
+            await _log_task
+        except asyncio.CancelledError:
+            pass
+
 @app.get("/")
 def read_root():
     return {"message": "GST Calculator API Running"}
 
 @app.get("/test")
-def test_database():
+async def test_database():
     """Test endpoint to check if database is available and accessible"""
     response = {
         "backend": "✅ Running",
@@ -39,7 +125,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -49,34 +135,198 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if _HAS_DB_URL else "❌ Not Set"
+    response["database_name"] = "✅ Set" if _HAS_DB_NAME else "❌ Not Set"
     return response
 
+# In-process category cache, refreshed at most every _CAT_CACHE_TTL seconds
+_CAT_CACHE_TTL = 60.0
+_CAT_RETRY_DELAY = 1.5  # after a failed refresh, keep serving the last snapshot this long before retrying
+_CAT_PROJECTION = {"_id": 0, "name": 1, "rate": 1, "keywords": 1, "active": 1}
+# "gen" is bumped by add_category so a refresh already in flight can't store a stale snapshot
+_CAT_CACHE = {"ts": 0.0, "failed_ts": 0.0, "gen": 0, "data": [], "index": [], "automaton": None, "buckets": {}}
+_CAT_LOCK = asyncio.Lock()
+
+def _build_category_index(categories: List[dict]) -> List[tuple]:
+    """Pair each category with its non-empty lowercased keywords (plus name), computed once per refresh"""
+    index = []
+    for c in categories:
+        kws = [kw.lower() for kw in c.get("keywords", []) if kw]
+        if c.get("name"):
+            kws.append(c["name"].lower())
+        index.append((tuple(kws), c))
+    return index
+
+def _keyword_owners(index: List[tuple]) -> dict:
+    """Map each distinct keyword to the index positions of the categories that use it"""
+    owners = {}
+    for idx, (kws, _) in enumerate(index):
+        for kw in kws:
+            owners.setdefault(kw, []).append(idx)
+    return owners
+
+def _build_automaton(owners: dict):
+    """Build one Aho-Corasick automaton over every keyword"""
+    if ahocorasick is None or not owners:
+        return None
+    automaton = ahocorasick.Automaton()
+    for kw, idxs in owners.items():
+        automaton.add_word(kw, (kw, tuple(idxs)))
+    automaton.make_automaton()
+    return automaton
+
+# ASCII-only lowercasing for the bucket scan. It equals str.lower() on ASCII text, which is
+# how keywords are lowercased at cache build time; other text goes through str.lower().
+_LC_TABLE = bytes.maketrans(bytes(range(65, 91)), bytes(range(97, 123)))
+
+def _build_buckets(owners: dict) -> dict:
+    """Group UTF-8 encoded keywords by their first byte, for scanning without pyahocorasick"""
+    buckets = {}
+    for kw, idxs in owners.items():
+        kw_bytes = kw.encode("utf-8")
+        buckets.setdefault(kw_bytes[0], []).append((kw_bytes, tuple(idxs)))
+    return buckets
+
+def _categories_fresh() -> bool:
+    now = time.monotonic()
+    if _CAT_CACHE["failed_ts"] and now - _CAT_CACHE["failed_ts"] < _CAT_RETRY_DELAY:
+        return True
+    return bool(_CAT_CACHE["ts"]) and now - _CAT_CACHE["ts"] < _CAT_CACHE_TTL
+
+async def _refresh_categories() -> None:
+    if _categories_fresh():
+        return
+    # One refresh at a time; requests that waited on the lock reuse its result
+    async with _CAT_LOCK:
+        if _categories_fresh():
+            return
+        gen = _CAT_CACHE["gen"]
+        now = time.monotonic()
+        try:
+            categories = await get_documents("gstcategory", {}, projection=_CAT_PROJECTION)
+        except Exception:
+            # Keep the previous snapshot; requests queued on the lock skip straight past it
+            _CAT_CACHE["failed_ts"] = time.monotonic()
+            return
+        if _CAT_CACHE["gen"] != gen:
+            # A category was added while we were querying; this snapshot may miss it
+            return
+        index = _build_category_index(categories)
+        owners = _keyword_owners(index)
+        automaton = _build_automaton(owners)
+        _CAT_CACHE["data"] = categories
+        _CAT_CACHE["index"] = index
+        _CAT_CACHE["automaton"] = automaton
+        _CAT_CACHE["buckets"] = _build_buckets(owners) if automaton is None else {}
+        _CAT_CACHE["ts"] = now
+        _CAT_CACHE["failed_ts"] = 0.0
+
+async def _get_cached_categories() -> List[dict]:
+    await _refresh_categories()
+    return _CAT_CACHE["data"]
+
 # AI-like matching using keyword similarity (simple heuristic)
 
-def detect_category(description: str) -> Optional[GSTCategory]:
-    description = (description or "").lower()
+def _score_categories(description: str, automaton, buckets: dict) -> dict:
+    """Map index position -> number of its keywords found in the description, for matched categories only"""
+    scores = {}
+    seen = set()
+    if automaton is not None:
+        for _, (kw, idxs) in automaton.iter(description.lower()):
+            # A keyword counts once no matter how often it occurs
+            if kw in seen:
+                continue
+            seen.add(kw)
+            for idx in idxs:
+                scores[idx] = scores.get(idx, 0) + 1
+        return scores
+    # Only try the keywords whose first byte matches the current position
+    if description.isascii():
+        desc_bytes = description.encode("ascii").translate(_LC_TABLE)
+    else:
+        desc_bytes = description.lower().encode("utf-8", "ignore")
+    for i, b in enumerate(desc_bytes):
+        for kw_bytes, idxs in buckets.get(b, ()):
+            if kw_bytes in seen or not desc_bytes.startswith(kw_bytes, i):
+                continue
+            seen.add(kw_bytes)
+            for idx in idxs:
+                scores[idx] = scores.get(idx, 0) + 1
+    return scores
+
+async def detect_category(description: str) -> Optional[dict]:
+    """Return the cached category document that best matches the description"""
+    if not description or not description.strip():
+        return None
+    await _refresh_categories()
+    index = _CAT_CACHE["index"]
+    scores = _score_categories(description, _CAT_CACHE["automaton"], _CAT_CACHE["buckets"])
+    if not scores:
+        return None
+    # Highest score wins; ties go to the category listed first
+    best_idx = max(scores, key=lambda idx: (scores[idx], -idx))
+    return index[best_idx][1]
+
+# Tax is computed exactly on integer ratios. Amounts in whole paise and rates in whole
+# basis points take an all-integer fast path; anything finer is parsed exactly with Fraction.
+_MAX_FAST_AMOUNT = 1e13  # keeps amount * 100 far inside the range where floats hold exact integers
+
+def _amount_ratio(amount: float) -> tuple:
+    """Amount in paise as (numerator, denominator)"""
+    if amount < _MAX_FAST_AMOUNT:
+        amount_p = round(amount * 100)
+        if amount_p / 100 == amount:
+            return amount_p, 1
+    # str() gives the shortest repr, so 0.125 becomes exactly 1/8
+    exact = Fraction(str(amount)) * 100
+    return exact.numerator, exact.denominator
+
+# Standard GST slabs in basis points, so the common rates skip the float round-trip check
+_RATE_TO_BP = {0.0: 0, 5.0: 500, 12.0: 1200, 18.0: 1800, 28.0: 2800}
+
+def _rate_ratio(rate: float) -> tuple:
+    """Rate as a fraction of 1, as (numerator, denominator)"""
+    rate_bp = _RATE_TO_BP.get(rate)
+    if rate_bp is not None:
+        return rate_bp, 10000
+    rate_bp = round(rate * 100)
+    if rate_bp / 100 == rate:
+        return rate_bp, 10000
+    exact = Fraction(str(rate)) / 100
+    return exact.numerator, exact.denominator
+
+# Each returns (net, gst, gross) in paise, rounded half up to the nearest paisa:
+# round_half_up(n / d) == (2 * n + d) // (2 * d) for non-negative n.
+
+def _calc_exclusive(amount_n: int, amount_d: int, rate_n: int, rate_d: int) -> tuple:
+    net_p = (2 * amount_n + amount_d) // (2 * amount_d)
+    den = 2 * amount_d * rate_d
+    gst_p = (2 * amount_n * rate_n + amount_d * rate_d) // den
+    return net_p, gst_p, net_p + gst_p
+
+def _calc_inclusive(amount_n: int, amount_d: int, rate_n: int, rate_d: int) -> tuple:
+    gross_p = (2 * amount_n + amount_d) // (2 * amount_d)
+    den = amount_d * (rate_d + rate_n)
+    net_p = (2 * amount_n * rate_d + den) // (2 * den)
+    return net_p, gross_p - net_p, gross_p
+
+def _paise_to_rupees(value_p: int) -> float:
+    """Convert paise to rupees, saturating at inf for results beyond the float range"""
     try:
-        categories = get_documents("gstcategory", {})
-    except Exception:
-        categories = []
-    best = None
-    best_score = 0
-    for cat in categories:
-        kws = [k.lower() for k in cat.get("keywords", [])] + [cat.get("name", "").lower()]
-        score = sum(1 for k in kws if k and k in description)
-        if score > best_score:
-            best_score = score
-            best = cat
-    if best:
-        return GSTCategory(
-            name=best.get("name"),
-            rate=float(best.get("rate", 0)),
-            keywords=best.get("keywords", []),
-            active=best.get("active", True)
-        )
-    return None
+        return value_p / 100
+    except OverflowError:
+        return math.inf
+
+def _calc_non_finite(mode: str, amount: float, rate: float) -> tuple:
+    """Plain float math for an infinite amount, which has no exact ratio; returns rupees"""
+    r = rate / 100.0
+    if mode == "exclusive":
+        gst = amount * r
+        return amount, gst, amount + gst
+    net = amount / (1 + r)
+    return net, amount - net, amount
+
+_CALC_HANDLERS = {"exclusive": _calc_exclusive, "inclusive": _calc_inclusive}
 
 class CalculateRequest(BaseModel):
     amount: float = Field(..., ge=0)
@@ -92,61 +342,68 @@ class CalculateResponse(BaseModel):
     detected_category: Optional[str]
     source: str
 
-@app.post("/api/calculate", response_model=CalculateResponse)
+# CalculateResponse documents the shape; the handler returns a plain dict so it isn't re-validated
+@app.post("/api/calculate", responses={200: {"model": CalculateResponse}})
 async def calculate_tax(payload: CalculateRequest):
     amount = payload.amount
     mode = payload.mode.lower()
-    if mode not in ("exclusive", "inclusive"):
+    handler = _CALC_HANDLERS.get(mode)
+    if handler is None:
         raise HTTPException(status_code=400, detail="mode must be 'exclusive' or 'inclusive'")
 
     detected = None
+    detected_name = None
     source = "default"
     applied_rate = 18.0  # default rate if nothing provided or detected
 
     if payload.rate is not None:
         applied_rate = payload.rate
         source = "provided"
-    else:
-        detected = detect_category(payload.description or "")
-        if detected and detected.active:
-            applied_rate = detected.rate
-            source = "detected"
-
-    r = applied_rate / 100.0
+    elif payload.description:
+        detected = await detect_category(payload.description)
+        if detected:
+            detected_name = detected.get("name")
+            if detected.get("active", True):
+                applied_rate = float(detected.get("rate", 0))
+                source = "detected"
 
-    if mode == "exclusive":
-        net = amount
-        gst = round(net * r, 2)
-        gross = round(net + gst, 2)
-    else:  # inclusive
-        gross = amount
-        net = round(gross / (1 + r), 2)
-        gst = round(gross - net, 2)
+    if math.isfinite(amount):
+        net_p, gst_p, gross_p = handler(*_amount_ratio(amount), *_rate_ratio(applied_rate))
+        try:
+            # int / int divides exactly before converting to float
+            net, gst, gross = net_p / 100, gst_p / 100, gross_p / 100
+        except OverflowError:
+            net, gst, gross = _paise_to_rupees(net_p), _paise_to_rupees(gst_p), _paise_to_rupees(gross_p)
+    else:
+        net, gst, gross = _calc_non_finite(mode, amount, applied_rate)
 
     # Log calculation
-    try:
-        calc = GSTCalculation(
-            amount=amount,
-            mode=mode,
-            applied_rate=applied_rate,
-            computed_tax=gst,
-            net_amount=net,
-            gross_amount=gross,
-            detected_category=detected.name if detected else None,
-            source=source,
-        )
-        create_document("gstcalculation", calc)
-    except Exception:
-        pass
+    if db is not None and _log_queue is not None:
+        try:
+            calc = GSTCalculation(
+                amount=amount,
+                mode=mode,
+                applied_rate=applied_rate,
+                computed_tax=gst,
+                net_amount=net,
+                gross_amount=gross,
+                detected_category=detected_name,
+                source=source,
+            )
+            log = calc.model_dump()
+            log["created_at"] = datetime.now(timezone.utc)
+            _log_queue.put_nowait(log)
+        except Exception:
+            pass
 
-    return CalculateResponse(
-        net_amount=net,
-        gst_amount=gst,
-        gross_amount=gross,
-        applied_rate=applied_rate,
-        detected_category=detected.name if detected else None,
-        source=source,
-    )
+    return {
+        "net_amount": net,
+        "gst_amount": gst,
+        "gross_amount": gross,
+        "applied_rate": applied_rate,
+        "detected_category": detected_name,
+        "source": source,
+    }
 
 class CategoryIn(BaseModel):
     name: str
@@ -157,7 +414,7 @@ class CategoryIn(BaseModel):
 @app.get("/api/categories")
 async def list_categories():
     try:
-        cats = get_documents("gstcategory", {})
+        cats = await _get_cached_categories()
         # sanitize
         return [
             {
@@ -173,7 +430,10 @@ async def list_categories():
 @app.post("/api/categories")
 async def add_category(cat: CategoryIn):
     try:
-        create_document("gstcategory", cat.model_dump())
+        await create_document("gstcategory", cat.model_dump())
+        _CAT_CACHE["gen"] += 1
+        _CAT_CACHE["ts"] = 0.0
+        _CAT_CACHE["failed_ts"] = 0.0
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))